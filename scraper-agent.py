@@ -1,18 +1,17 @@
 import os
-import time
 import asyncio
 import logging
-import json
 import re
+import orjson
 import aiohttp
 import aiofiles
-import requests
-from urllib.parse import urlparse
-from collections import deque
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException
+import lxml.html
+from lxml import etree
+from selectolax.parser import HTMLParser
+import hashlib
+from urllib.parse import urlparse, urljoin
+from collections import OrderedDict
+from playwright.async_api import async_playwright
 
 # -----------------------------
 # CONFIGURATION
@@ -22,10 +21,14 @@ DOWNLOAD_DIR = "./pdfs"
 SCRAPED_PAGES_DIR = "./scraped_pages"
 LOG_LEVEL = logging.INFO
 DOWNLOAD_LOG_FILE = "download_log.csv"
-LLM_API_URL = "http://127.0.0.1:8000/generate_selectors"
+LLM_API_URL = "http://127.0.0.1:8000/generate_selectors_batch"
 # **FIX APPLIED HERE: Reduced chunk size to prevent token overflow**
 CHUNK_SIZE = 4500  # Characters per chunk, fits safely within phi-2's context
 CHUNK_OVERLAP = 400   # Characters of overlap to avoid splitting elements
+NUM_WORKERS = 8    # Concurrent crawl workers pulling from the page queue
+SANITIZE_RE = re.compile(r'[\\/*?:"<>|]')  # Strips filesystem-hostile characters from filenames
+MAX_CONCURRENT_DOWNLOADS = 32  # Cap on simultaneous PDF download sockets
+DOWNLOAD_CHUNK_SIZE = 1 << 16  # Stream PDFs to disk in 64KB chunks
 
 # Ensure all necessary directories exist
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
@@ -50,23 +53,51 @@ if os.path.getsize(DOWNLOAD_LOG_FILE) == 0:
     download_logger.info("PDF_URL,SOURCE_URL")
 
 # -----------------------------
-# SELENIUM SETUP
+# IN-BROWSER CLICK BATCH
 # -----------------------------
-options = Options()
-options.add_argument("--headless")
-options.add_argument("--disable-gpu")
-options.add_argument("--window-size=1920,1080")
-prefs = {
-    "download.default_directory": os.path.abspath(DOWNLOAD_DIR),
-    "download.prompt_for_download": False,
-    "plugins.always_open_pdf_externally": True
+# One JS pass does every querySelector/scroll/click in-page, instead of
+# multiple driver round-trips and waits per selector.
+CLICK_SELECTORS_SCRIPT = """
+(selectors) => {
+    const clicked = [];
+    for (const selector of selectors) {
+        let el = null;
+        try { el = document.querySelector(selector); } catch (e) {}
+        if (el) {
+            el.scrollIntoView();
+            el.click();
+            clicked.push(selector);
+        }
+    }
+    return clicked;
 }
-options.add_experimental_option("prefs", prefs)
-try:
-    driver = webdriver.Chrome(options=options)
-except Exception as e:
-    main_logger.error(f"Failed to initialize Selenium WebDriver: {e}")
-    exit()
+"""
+
+# -----------------------------
+# DETERMINISTIC FAST PATH (NO LLM)
+# -----------------------------
+# Most index pages (govinfo.gov included) expose PDFs through a handful of
+# predictable patterns. Each entry pairs an xpath probe with the CSS selector
+# handed to the browser when the probe hits, so PDF-rich pages never touch the GPU.
+PDF_FAST_PATH_RULES = [
+    ("//a[contains(translate(@href,'PDF','pdf'),'.pdf')]", "a[href$='.pdf' i]"),
+    ("//a[contains(@class,'download')]", "a.download"),
+    ("//button[contains(@data-href,'.pdf')]", "button[data-href$='.pdf']"),
+]
+
+def detect_selectors_fast(html):
+    """Finds PDF-like links with lxml; returns [] if the page needs the LLM."""
+    try:
+        tree = lxml.html.fromstring(html)
+    except Exception as e:
+        main_logger.warning(f"lxml failed to parse page, falling back to LLM: {e}")
+        return []
+
+    selectors = []
+    for xpath, css_selector in PDF_FAST_PATH_RULES:
+        if tree.xpath(xpath):
+            selectors.append(css_selector)
+    return selectors
 
 # -----------------------------
 # LLM API COMMUNICATION (CHUNK-BASED)
@@ -81,82 +112,175 @@ def chunk_html(html_content, size, overlap):
         start += size - overlap
     return chunks
 
-def call_llm_api(html_chunk):
-    """(Synchronous) Calls the local LLM API for a single chunk."""
+def compact_linkable_html(html):
+    """
+    Reduces a full page to just the elements the LLM can act on: anchors,
+    buttons, table rows and list items that carry an href/class/id. Scripts,
+    styles and SVG boilerplate are dropped, so the model's attention (and our
+    chunk count) goes to structure instead of page chrome.
+    """
     try:
-        response = requests.post(LLM_API_URL, json={"html": html_chunk}, timeout=120)
-        response.raise_for_status()
-        return response.json().get("result_text", "")
-    except requests.exceptions.RequestException as e:
-        main_logger.error(f"LLM API call failed: {e}")
-        return None
+        tree = lxml.html.fromstring(html)
+    except Exception as e:
+        main_logger.warning(f"lxml failed to compact page, using raw HTML: {e}")
+        return html
+
+    etree.strip_elements(tree, 'script', 'style', 'svg', 'noscript', with_tail=False)
+    pieces = []
+    for element in tree.iter('a', 'button', 'tr', 'li'):
+        if element.get('href') or element.get('class') or element.get('id'):
+            # Cap each element so one bloated row can't dominate a chunk.
+            pieces.append(etree.tostring(element, encoding='unicode')[:200])
+    return "\n".join(pieces) if pieces else html
+
+async def call_llm_api_batch(session, html_chunks):
+    """Sends all chunks of a page to the LLM API in a single batch request."""
+    try:
+        async with session.post(LLM_API_URL, json={"htmls": html_chunks}, timeout=300) as response:
+            response.raise_for_status()
+            data = await response.json()
+            return data.get("result_texts", [])
+    except Exception as e:
+        main_logger.error(f"LLM API batch call failed: {e}")
+        return []
+
+def parse_selectors_from_response(result_str):
+    """
+    Extracts the selector list from one raw model response. Constrained
+    decoding on the server guarantees a {"selectors": [...]} object, so this
+    is a straight parse with a guard for transport-level garbage.
+    """
+    if not result_str:
+        return []
+    try:
+        return orjson.loads(result_str).get("selectors", [])
+    except Exception as e:
+        main_logger.error(f"Error parsing chunk response: {e}\nRaw response: {result_str}")
+    return []
+
+# Chunk-level response cache. Domain-scoped crawls repeat the same navbar,
+# sidebar and footer chunks on nearly every page; caching parsed results by
+# content hash makes those repeats free. Bounded so a long crawl can't grow it
+# without limit (oldest entries are evicted first).
+CHUNK_CACHE = OrderedDict()
+CHUNK_CACHE_MAX = 10_000
 
-async def detect_selectors_in_chunks(full_html):
+async def detect_selectors_in_chunks(session, full_html):
     """
     Analyzes the entire HTML page by breaking it into chunks,
-    sending them to the LLM concurrently, and combining the results.
+    sending them all in one batch to the LLM, and combining the results.
+    Chunks already seen this crawl are served from the cache.
     """
-    main_logger.info(f"Analyzing full HTML ({len(full_html)} chars) in {CHUNK_SIZE}-char chunks...")
-    html_chunks = chunk_html(full_html, CHUNK_SIZE, CHUNK_OVERLAP)
-    main_logger.info(f"Split HTML into {len(html_chunks)} chunks for concurrent analysis.")
-    
-    loop = asyncio.get_running_loop()
-    # Create a list of tasks to call the LLM API for each chunk
-    tasks = [loop.run_in_executor(None, call_llm_api, chunk) for chunk in html_chunks]
-    
-    # Run all API calls concurrently
-    api_responses = await asyncio.gather(*tasks)
-    
+    compact_html = compact_linkable_html(full_html)
+    main_logger.info(
+        f"Compacted HTML from {len(full_html)} to {len(compact_html)} chars; "
+        f"analyzing in {CHUNK_SIZE}-char chunks..."
+    )
+    html_chunks = chunk_html(compact_html, CHUNK_SIZE, CHUNK_OVERLAP)
+
     all_selectors = set() # Use a set to automatically handle duplicates
-    for result_str in api_responses:
-        if not result_str:
-            continue
-        try:
-            json_match = re.search(r'\{[\s\S]*\}|\[[\s\S]*\]', result_str)
-            if not json_match:
-                continue
-            
-            data = json.loads(json_match.group(0))
-            
-            selectors_list = []
-            if isinstance(data, dict):
-                for key, value in data.items():
-                    if isinstance(value, list):
-                        selectors_list = value
-                        break
-            elif isinstance(data, list):
-                selectors_list = data
-            
-            for selector in selectors_list:
-                all_selectors.add(selector)
-                
-        except Exception as e:
-            main_logger.error(f"Error parsing chunk response: {e}\nRaw response: {result_str}")
-            
+    pending_chunks = []   # (cache key, chunk) pairs that still need the LLM
+    pending_keys = set()
+    for chunk in html_chunks:
+        cache_key = hashlib.blake2b(chunk.encode()).digest()
+        if cache_key in CHUNK_CACHE:
+            CHUNK_CACHE.move_to_end(cache_key)
+            all_selectors.update(CHUNK_CACHE[cache_key])
+        elif cache_key not in pending_keys:
+            pending_keys.add(cache_key)
+            pending_chunks.append((cache_key, chunk))
+
+    main_logger.info(
+        f"Split HTML into {len(html_chunks)} chunks; "
+        f"{len(html_chunks) - len(pending_chunks)} served from cache, "
+        f"{len(pending_chunks)} sent for batched analysis."
+    )
+
+    if pending_chunks:
+        # One POST carries every uncached chunk; the server's engine batches
+        # them on-GPU, replacing the old one-HTTP-request-per-chunk fan-out.
+        api_responses = await call_llm_api_batch(session, [chunk for _, chunk in pending_chunks])
+        for (cache_key, _), result_str in zip(pending_chunks, api_responses):
+            parsed = parse_selectors_from_response(result_str)
+            CHUNK_CACHE[cache_key] = parsed
+            if len(CHUNK_CACHE) > CHUNK_CACHE_MAX:
+                CHUNK_CACHE.popitem(last=False)
+            all_selectors.update(parsed)
+
     main_logger.info(f"Reduced {len(all_selectors)} unique selectors from all chunks.")
     return list(all_selectors)
 
+# -----------------------------
+# STATIC PAGE FETCHING (NO BROWSER)
+# -----------------------------
+# Markers of an SPA shell that ships an empty mount point and hydrates
+# client-side; those pages genuinely need a browser to render.
+SPA_SHELL_MARKERS = ('<div id="root"></div>', '<div id="app"></div>')
+
+async def fetch_static(session, url):
+    """
+    Fetches a page over plain HTTP, skipping the browser entirely. Returns the
+    HTML, or None when the page looks JS-hydrated and needs the browser fallback.
+    """
+    try:
+        async with session.get(url, timeout=30) as response:
+            response.raise_for_status()
+            if 'html' not in response.headers.get('Content-Type', 'text/html'):
+                return None
+            html = await response.text()
+    except Exception as e:
+        main_logger.warning(f"Static fetch failed for {url}, falling back to browser: {e}")
+        return None
+
+    if len(html) < 1024 or any(marker in html for marker in SPA_SHELL_MARKERS):
+        return None
+    return html
+
+def extract_links_static(html, base_url):
+    """
+    Pulls (pdf_links, page_links) out of static HTML with selectolax —
+    C-backed parsing, so this stays cheap even on large index pages.
+    """
+    pdf_links = set()
+    page_links = set()
+    for node in HTMLParser(html).css('a[href]'):
+        href = node.attributes.get('href')
+        if not href:
+            continue
+        absolute = urljoin(base_url, href)
+        if absolute.lower().split('?')[0].endswith('.pdf'):
+            pdf_links.add(absolute)
+        elif absolute.startswith('http'):
+            page_links.add(absolute)
+    return pdf_links, page_links
+
 # -----------------------------
 # CONCURRENT PDF DOWNLOADER
 # -----------------------------
+# Caps concurrent sockets so a page full of PDFs can't exhaust file
+# descriptors; streaming keeps peak memory at O(downloads x chunk size)
+# instead of buffering every full body at once.
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
 async def download_pdf_concurrently(session, pdf_url, source_url):
-    """Asynchronously downloads a single PDF and logs the result."""
+    """Asynchronously streams a single PDF to disk and logs the result."""
     try:
-        async with session.get(pdf_url, timeout=60) as response:
-            response.raise_for_status()
-            content = await response.read()
-            
-            file_name = pdf_url.split('/')[-1].split('?')[0] # Clean query params
-            if not file_name: file_name = "downloaded_file.pdf"
-            if not file_name.lower().endswith('.pdf'): file_name += ".pdf"
-            file_path = os.path.join(DOWNLOAD_DIR, re.sub(r'[\\/*?:"<>|]', "_", file_name))
-
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(content)
-            
-            main_logger.info(f"SUCCESS downloading {pdf_url}")
-            download_logger.info(f"{pdf_url},{source_url}")
-            return pdf_url
+        async with download_semaphore:
+            async with session.get(pdf_url, timeout=60) as response:
+                response.raise_for_status()
+
+                file_name = pdf_url.split('/')[-1].split('?')[0] # Clean query params
+                if not file_name: file_name = "downloaded_file.pdf"
+                if not file_name.lower().endswith('.pdf'): file_name += ".pdf"
+                file_path = os.path.join(DOWNLOAD_DIR, SANITIZE_RE.sub("_", file_name))
+
+                async with aiofiles.open(file_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+
+        main_logger.info(f"SUCCESS downloading {pdf_url}")
+        download_logger.info(f"{pdf_url},{source_url}")
+        return pdf_url
     except Exception as e:
         main_logger.error(f"FAILED downloading {pdf_url}: {e}")
         return None
@@ -164,86 +288,139 @@ async def download_pdf_concurrently(session, pdf_url, source_url):
 # -----------------------------
 # MAIN SCRAPER LOOP
 # -----------------------------
+def url_netloc(url):
+    """
+    Extracts the host[:port] of an absolute URL with two string scans.
+    The domain filter runs once per discovered link (thousands per page),
+    where a full urlparse allocation per call is measurable overhead.
+    """
+    scheme_end = url.find('://')
+    if scheme_end == -1:
+        return ''
+    host_start = scheme_end + 3
+    host_end = url.find('/', host_start)
+    return url[host_start:] if host_end == -1 else url[host_start:host_end]
+
+def url_fingerprint(url):
+    """
+    64-bit fingerprint for URL bookkeeping. The visited/downloaded sets only
+    need membership, so storing an 8-byte int per URL instead of the full
+    string cuts their memory roughly tenfold on large crawls.
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), 'big')
+
 async def main():
     base_domain = urlparse(START_URL).netloc
     main_logger.info(f"Scraping initiated. Staying within domain: {base_domain}")
 
-    visited_pages = set()
-    downloaded_pdf_urls = set()
-    queue = deque([START_URL])
-
-    async with aiohttp.ClientSession() as session:
-        while queue:
-            url = queue.popleft()
-            if url in visited_pages:
-                continue
-            
-            try:
-                main_logger.info(f"Visiting: {url} (Queue size: {len(queue)})")
-                driver.get(url)
-                visited_pages.add(url)
-                time.sleep(5) 
-                
-                html = driver.page_source
-                safe_filename = re.sub(r'[\\/*?:"<>|]', "_", url) + ".html"
-                async with aiofiles.open(os.path.join(SCRAPED_PAGES_DIR, safe_filename), 'w', encoding='utf-8') as f:
-                    await f.write(html)
-                
-                # --- Get selectors from LLM using the new chunking method ---
-                selectors = await detect_selectors_in_chunks(html)
-                
-                # --- Click links and discover PDFs ---
-                pdf_links_on_page = set()
-                main_logger.info(f"Attempting to click {len(selectors)} selectors on {url}")
-                for selector in selectors:
+    visited_fps = {url_fingerprint(START_URL)}  # URLs are marked visited when queued
+    downloaded_pdf_fps = set()
+    queue = asyncio.Queue()
+    await queue.put(START_URL)
+
+    # One pooled session for everything (LLM API, page fetches, downloads).
+    # Long keepalive means the localhost LLM connection is reused across
+    # pages instead of paying a TCP handshake per batch.
+    connector = aiohttp.TCPConnector(limit=64, keepalive_timeout=300)
+    async with aiohttp.ClientSession(connector=connector) as session, async_playwright() as playwright:
+        # One Chromium process shared by all workers; each render gets its own
+        # lightweight context, so SPA pages no longer serialise on a single
+        # browser the way the old Selenium instance did.
+        browser = await playwright.chromium.launch(headless=True)
+
+        async def process_page(url):
+            main_logger.info(f"Visiting: {url} (Queue size: {queue.qsize()})")
+
+            pdf_links_on_page = set()
+            new_page_links = set()
+
+            # --- Fetch: plain HTTP first, a browser only for JS-hydrated pages ---
+            html = await fetch_static(session, url)
+            if html is not None:
+                # Static HTML: nothing to click, so harvest links directly.
+                pdf_links_on_page, new_page_links = extract_links_static(html, url)
+            else:
+                main_logger.info(f"Page needs a browser, rendering with Playwright: {url}")
+                context = await browser.new_context()
+                page = await context.new_page()
+                try:
+                    await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+                    html = await page.content()
+
+                    # --- Get selectors: deterministic fast path first, LLM fallback ---
+                    selectors = detect_selectors_fast(html)
+                    if selectors:
+                        main_logger.info(f"Fast path matched {len(selectors)} selector rules; skipping LLM.")
+                    else:
+                        selectors = await detect_selectors_in_chunks(session, html)
+
+                    # --- Click links and discover PDFs ---
+                    main_logger.info(f"Attempting to click {len(selectors)} selectors on {url}")
                     try:
-                        element = driver.find_element(By.CSS_SELECTOR, selector)
-                        driver.execute_script("arguments[0].scrollIntoView(true);", element)
-                        time.sleep(0.5)
-                        element.click()
-                        time.sleep(2)
+                        clicked = await page.evaluate(CLICK_SELECTORS_SCRIPT, list(selectors))
+                        main_logger.info(f"Clicked {len(clicked)} of {len(selectors)} selectors in-page.")
+                        # One wait for everything the clicks triggered to settle.
+                        await page.wait_for_load_state("domcontentloaded")
                     except Exception as e:
-                        main_logger.warning(f"Could not click selector '{selector}': {e}")
-                
-                pdf_elements = driver.find_elements(By.CSS_SELECTOR, "a[href$='.pdf' i]")
-                for element in pdf_elements:
-                    href = element.get_attribute('href')
-                    if href:
-                        pdf_links_on_page.add(href)
-                
-                # --- Create and run PDF download tasks concurrently ---
-                download_tasks = []
-                for pdf_url in pdf_links_on_page:
-                    if pdf_url not in downloaded_pdf_urls:
-                        downloaded_pdf_urls.add(pdf_url)
-                        task = download_pdf_concurrently(session, pdf_url, url)
-                        download_tasks.append(task)
-                
-                if download_tasks:
-                    main_logger.info(f"Starting concurrent download of {len(download_tasks)} PDFs...")
-                    await asyncio.gather(*download_tasks)
-
-                # --- Discover new links to crawl (domain-scoped) ---
-                link_elements = driver.find_elements(By.TAG_NAME, 'a')
-                for link in link_elements:
-                    href = link.get_attribute('href')
-                    if href and href.startswith('http'):
-                        if urlparse(href).netloc == base_domain:
-                            if href not in visited_pages and href not in queue:
-                                queue.append(href)
-
-            except Exception as e:
-                main_logger.error(f"A critical error occurred while processing {url}: {e}")
+                        main_logger.warning(f"In-page click batch failed on {url}: {e}")
+
+                    # Grab the post-click DOM once and parse anchors locally
+                    # with selectolax; per-anchor query_selector/get_attribute
+                    # round-trips dominate discovery on link-heavy pages.
+                    html = await page.content()
+                    pdf_links_on_page, new_page_links = extract_links_static(html, url)
+                finally:
+                    await context.close()
+
+            safe_filename = SANITIZE_RE.sub("_", url) + ".html"
+            async with aiofiles.open(os.path.join(SCRAPED_PAGES_DIR, safe_filename), 'w', encoding='utf-8') as f:
+                await f.write(html)
+
+            # --- Create and run PDF download tasks concurrently ---
+            download_tasks = []
+            for pdf_url in pdf_links_on_page:
+                pdf_fp = url_fingerprint(pdf_url)
+                if pdf_fp not in downloaded_pdf_fps:
+                    downloaded_pdf_fps.add(pdf_fp)
+                    task = download_pdf_concurrently(session, pdf_url, url)
+                    download_tasks.append(task)
+
+            if download_tasks:
+                main_logger.info(f"Starting concurrent download of {len(download_tasks)} PDFs...")
+                await asyncio.gather(*download_tasks)
+
+            # --- Queue new links to crawl (domain-scoped) ---
+            for href in new_page_links:
+                if url_netloc(href) == base_domain:
+                    href_fp = url_fingerprint(href)
+                    if href_fp not in visited_fps:
+                        visited_fps.add(href_fp)
+                        await queue.put(href)
+
+        async def worker(worker_id):
+            while True:
+                url = await queue.get()
+                try:
+                    await process_page(url)
+                except Exception as e:
+                    main_logger.error(f"A critical error occurred while processing {url}: {e}")
+                finally:
+                    queue.task_done()
+
+        # With static fetching doing most of the work, NUM_WORKERS pages are
+        # in flight at once: page fetches, LLM batches and PDF downloads all
+        # overlap instead of running strictly one page at a time.
+        workers = [asyncio.create_task(worker(i)) for i in range(NUM_WORKERS)]
+        await queue.join()
+        for w in workers:
+            w.cancel()
+        await browser.close()
 
     main_logger.info("="*50)
     main_logger.info("Scraping queue is empty. Process complete.")
-    driver.quit()
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         main_logger.info("Scraping interrupted by user.")
-    finally:
-        if 'driver' in locals() and driver:
-            driver.quit()